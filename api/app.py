@@ -1,11 +1,19 @@
 import os, logging
-from fastapi import FastAPI, Request, Header, Response
+import asyncio
+import httpx
+import orjson
+from fastapi import BackgroundTasks, FastAPI, Request, Header, Response
+from fastapi.responses import ORJSONResponse
+from redis.asyncio import Redis
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.request import HTTPXRequest
 
 # Senin dosyaların:
+from config import Config
 from database import DatabaseManager
 from bot_handlers import BotHandlers
+from outbox import Outbox
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -15,14 +23,30 @@ logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 SECRET_TOKEN = os.environ.get("SECRET_TOKEN", "")
+MAX_PENDING_UPDATES = int(os.environ.get("MAX_PENDING_UPDATES", "200"))
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+# Redis opsiyonel: tanımlı değilse cache devre dışı, her şey DB'den okunur
+redis_client = Redis.from_url(REDIS_URL) if REDIS_URL else None
 
 # --- PTB app + handler'lar ---
 db_manager = DatabaseManager()
 db_manager.init_database()
 
-bot_handlers = BotHandlers(db_manager)
+# Büyük havuz + HTTP/2: eşzamanlı sendMessage çağrıları havuzda sıraya girmesin
+request = HTTPXRequest(connection_pool_size=256, http_version="2", pool_timeout=5)
+application = Application.builder().token(BOT_TOKEN).request(request).build()
+
+async def fast_send(chat_id: int, text: str, **params):
+    """Düz sendMessage: PTB katmanı olmadan paylaşılan HTTP/2 client ile"""
+    response = await app.state.httpx.post("sendMessage", json={"chat_id": chat_id, "text": text, **params})
+    result = orjson.loads(response.content)
+    if not result.get("ok"):
+        raise RuntimeError(f"sendMessage failed ({response.status_code}): {result.get('description')}")
 
-application = Application.builder().token(BOT_TOKEN).build()
+# Grup bildirimleri Telegram limitinin altında (25 msg/sn) sıraya alınır
+outbox = Outbox(fast_send)
+bot_handlers = BotHandlers(db_manager, outbox, redis_client)
 application.add_handler(CommandHandler("start", bot_handlers.start_command))
 application.add_handler(CommandHandler("help", bot_handlers.help_command))
 application.add_handler(CommandHandler("register", bot_handlers.register_command))
@@ -34,32 +58,92 @@ application.add_handler(CommandHandler("reset_daily", bot_handlers.reset_daily_c
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND,
                                        bot_handlers.handle_message))
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.on_event("startup")
 async def _startup():
     await application.initialize()
     await application.start()
+    app.state.httpx = httpx.AsyncClient(
+        base_url=f"https://api.telegram.org/bot{BOT_TOKEN}/",
+        http2=True,
+        limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+    )
+    outbox.start()
+    await bot_handlers.sync_daily_ranking()
+    await bot_handlers.sync_message_rights()
     logger.info("Bot ready (webhook mode)")
 
 @app.on_event("shutdown")
 async def _shutdown():
+    await outbox.stop()
+    await app.state.httpx.aclose()
     await application.stop()
     await application.shutdown()
+    if redis_client is not None:
+        await redis_client.aclose()
+    db_manager.pool.close()
 
 @app.get("/")
 async def health():
     return {"ok": True}
 
+# Arka planda işlenen update sayısı için üst sınır
+update_slots = asyncio.Semaphore(MAX_PENDING_UPDATES)
+
+async def _process_update(update: Update):
+    try:
+        await application.process_update(update)
+    finally:
+        update_slots.release()
+
+async def _rate_limited(data: dict) -> bool:
+    """Kullanıcı başına dakikalık komut limiti (Redis sabit pencere)"""
+    if redis_client is None:
+        return False
+
+    message = data.get("message") or {}
+    user_id = (message.get("from") or {}).get("id")
+    if user_id is None or not (message.get("text") or "").startswith("/"):
+        return False
+
+    key = f"rl:{user_id}"
+    try:
+        # Pencere anahtarı süresiyle birlikte oluşturulur; INCR ile tek MULTI içinde gider
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(key, 0, nx=True, ex=60)
+            pipe.incr(key)
+            _, count = await pipe.execute()
+    except Exception as e:
+        logger.error(f"Rate limit check failed for {user_id}: {e}")
+        return False
+
+    return count > Config.MAX_COMMANDS_PER_MINUTE
+
 @app.post("/webhook")
 async def telegram_webhook(
     request: Request,
+    background: BackgroundTasks,
     x_telegram_bot_api_secret_token: str | None = Header(None)
 ):
     if SECRET_TOKEN and x_telegram_bot_api_secret_token != SECRET_TOKEN:
         return Response(status_code=403)
 
-    data = await request.json()
+    data = orjson.loads(await request.body())
+    if await _rate_limited(data):
+        # Telegram tekrar denemesin diye yine 200 dön
+        return {"ok": True}
+
     update = Update.de_json(data, application.bot)
-    await application.process_update(update)
+
+    # Slot yoksa sıraya girip bekle: Telegram yavaşlar, görev sayısı sınırsız büyümez
+    await update_slots.acquire()
+    background.add_task(_process_update, update)
     return {"ok": True}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools: event loop ve HTTP parse C tarafında
+    uvicorn.run(app, host=Config.KEEP_ALIVE_HOST, port=Config.KEEP_ALIVE_PORT,
+                loop="uvloop", http="httptools", workers=1)
@@ -3,21 +3,347 @@ Bot command handlers for the Telegram Study Battle Bot
 Handles all bot commands and user interactions
 """
 
+import asyncio
+import html
 import logging
-import os
-from telegram import Update
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+from redis.asyncio import Redis
+from telegram import Update, User
 from telegram.ext import ContextTypes
-from database import DatabaseManager
+from config import Config
+from database import DEMO_USER_NAME, DatabaseManager
+from outbox import Outbox
 from utils import format_leaderboard, parse_number, get_user_display_name
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+ADMIN_IDS = frozenset(Config.ADMIN_IDS)
+ADMIN_IDS_INVALID = Config.ADMIN_IDS_INVALID  # Malformed ADMIN_IDS denies admin commands to everyone
+if ADMIN_IDS_INVALID:
+    logger.error("ADMIN_IDS is malformed; admin commands are disabled until it is fixed")
+
+# Leaderboard cache settings (Redis)
+LEADERBOARD_CACHE_TTL = 10  # seconds
+DAILY_LEADERBOARD_CACHE_KEY = "lb:daily:fmt"  # rendered /lb message
+LIFETIME_LEADERBOARD_CACHE_KEY = "lb:lifetime:fmt"  # rendered /top message
+LEADERBOARD_GENERATION_KEY = "lb:gen"  # bumped with every invalidation of the rendered messages
+DAILY_RANKING_KEY = "lb:daily"  # ZSET mirror of today's scores, user_id -> questions_solved
+DAILY_RANKING_SYNCED = "synced"  # Member at -inf marking the ZSET as rebuilt from the database
+LEADERBOARD_SIZE = 10  # entries shown on /lb and /top; only moves into them are announced
+AUTO_LEADERBOARD_INTERVAL = 10  # seconds between automatic leaderboard posts per chat
+MESSAGE_RIGHTS_KEY = "msg_rights:users"  # SET of user_ids holding an unused special message right
+MESSAGE_RIGHTS_SYNCED = "synced"  # Member marking the SET as rebuilt from the database
+
+WELCOME_HTML_TMPL = """
+🎯 <b>Welcome to Study Battle Bot!</b> 🎯
+
+Hello {name}! 
+
+I'm here to help you track your daily study progress and compete with others!
+
+<b>Available Commands:</b>
+📚 <code>/solved &lt;number&gt;</code> - Log questions solved (supports negative numbers for corrections)
+🏆 <code>/lb</code> - View today's leaderboard
+👑 <code>/top</code> - View lifetime leaderboard
+📊 <code>/stats</code> - Check your personal statistics
+❓ <code>/help</code> - Show this help message
+
+<b>Features:</b>
+✅ Daily leaderboard that resets every 24 hours
+✅ Lifetime statistics that never reset
+✅ Support for negative corrections
+✅ Automatic leaderboard updates
+✅ 24/7 operation
+
+Start logging your solved questions with <code>/solved &lt;number&gt;</code>!
+Good luck with your studies! 📖
+"""
+
+# Built once at import; /help sends it as-is with no per-request formatting
+HELP_HTML = """
+🤖 <b>Study Battle Bot Help</b> 🤖
+
+<b>Commands:</b>
+📚 <code>/solved &lt;number&gt;</code> - Log solved questions
+   Examples: <code>/solved 5</code>, <code>/solved -2</code> (for corrections)
+
+🏆 <code>/lb</code> - Daily leaderboard (resets every 24 hours)
+👑 <code>/top</code> - Lifetime leaderboard (never resets)
+📊 <code>/stats</code> - Your personal statistics
+
+<b>Features:</b>
+• Daily tracking with automatic midnight reset
+• Lifetime statistics preservation
+• Negative number support for corrections
+• Automatic leaderboard updates after logging
+• Demo User exclusion from leaderboards
+
+<b>Tips:</b>
+• Use negative numbers to correct mistakes: <code>/solved -1</code>
+• Daily stats reset automatically at midnight UTC
+• Your lifetime stats are never reset
+• Bot operates 24/7 for continuous tracking
+
+Need more help? Contact the bot administrator!
+"""
+
+# Store a rendered leaderboard only if no invalidation happened since rendering began,
+# so a render based on rows read before a write commits is never cached after it.
+# KEYS = rendered message key, generation key; ARGV = generation read before rendering, TTL, message
+SET_RENDERED_LUA = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+end
+return 0
+"""
+
+# Apply a solved-count delta to the daily ranking in one atomic step, clamping at zero
+# like the database does. Positions follow the SQL RANK() (tied users share a place).
+# Returns false when the sync marker is missing (the ZSET was lost, e.g. Redis restarted
+# or evicted it), otherwise {old_pos, new_pos, outranked_id}: new_pos is 0 when the user
+# dropped off the ranking, outranked_id is the closest user now strictly below who was
+# strictly ahead before (lowest ID among ties), or 0 if nobody was passed.
+# KEYS[1] = ranking ZSET; ARGV = user_id, delta, sync marker member
+UPDATE_DAILY_RANKING_LUA = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[3]) then
+    return false
+end
+local old_score = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]) or 0)
+local score = math.max(0, old_score + tonumber(ARGV[2]))
+local old_pos
+if old_score > 0 then
+    old_pos = redis.call('ZCOUNT', KEYS[1], '(' .. old_score, '+inf') + 1
+else
+    -- A newcomer starts just below everyone already ranked (ZCARD counts the marker)
+    old_pos = redis.call('ZCARD', KEYS[1])
+end
+if score <= 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return {old_pos, 0, 0}
+end
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+local new_pos = redis.call('ZCOUNT', KEYS[1], '(' .. score, '+inf') + 1
+local outranked = 0
+local passed = redis.call('ZREVRANGEBYSCORE', KEYS[1], '(' .. score, '(' .. old_score, 'WITHSCORES', 'LIMIT', 0, 1)
+if passed[1] then
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], passed[2], passed[2])) do
+        local id = tonumber(member)
+        if outranked == 0 or id < outranked then
+            outranked = id
+        end
+    end
+end
+return {old_pos, new_pos, outranked}
+"""
+
+STATS_HTML_TMPL = """📊 <b>{name}'s Statistics</b>
+
+📅 <b>Today:</b> {daily} questions solved
+🏆 <b>Lifetime:</b> {lifetime} total questions
+
+"""
+
 class BotHandlers:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, outbox: Outbox, redis: Optional[Redis] = None):
         self.db = db_manager
-        self.last_leaderboard = []  # Store last leaderboard state
+        self.outbox = outbox  # Paced queue for group notifications
+        self.redis = redis  # Optional leaderboard cache
+        self._update_ranking_script = redis.register_script(UPDATE_DAILY_RANKING_LUA) if redis else None
+        self._set_rendered_script = redis.register_script(SET_RENDERED_LUA) if redis else None
+        self._ranking_lock = asyncio.Lock()  # Serializes score writes + ranking deltas with ranking rebuilds
+        self._rights_lock = asyncio.Lock()  # Serializes granted rights with message rights rebuilds
+        self._daily_ranks = None  # Last known {user_id: position}, None until first read
         self.chat_id = None  # Store group chat ID
+        self._auto_leaderboard_sent = {}  # chat_id -> monotonic time of last auto leaderboard
+    
+    async def _run_db(self, fn: Callable[..., T], *args) -> T:
+        """Run a blocking database call in a worker thread"""
+        return await asyncio.to_thread(fn, *args)
+    
+    async def _get_rendered(self, key: str, render: Callable[[], Awaitable[str]]) -> str:
+        """Get a rendered message from the Redis cache, rendering and storing it on a miss"""
+        generation = None
+        if self.redis:
+            try:
+                cached, generation = await self.redis.mget(key, LEADERBOARD_GENERATION_KEY)
+                if cached is not None:
+                    return cached.decode()
+                generation = generation.decode() if generation is not None else '0'
+            except Exception as e:
+                logger.error(f"Error reading leaderboard cache {key}: {e}")
+        
+        message = await render()
+        
+        if generation is not None:
+            try:
+                await self._set_rendered_script(
+                    keys=[key, LEADERBOARD_GENERATION_KEY], args=[generation, LEADERBOARD_CACHE_TTL, message]
+                )
+            except Exception as e:
+                logger.error(f"Error writing leaderboard cache {key}: {e}")
+        
+        return message
+    
+    async def _render_daily_leaderboard(self) -> str:
+        """Build the daily leaderboard message"""
+        leaderboard = await self._run_db(self.db.get_daily_leaderboard, LEADERBOARD_SIZE)
+        
+        if not leaderboard:
+            return "📅 <b>Daily Leaderboard</b>\n\n🤷‍♂️ No one has solved questions today yet."
+        
+        leaderboard = [(html.escape(name), count) for name, count in leaderboard]
+        return "📅 <b>Daily Leaderboard</b> (Resets every 24 hours)\n\n" + format_leaderboard(leaderboard, "questions today")
+    
+    async def _render_lifetime_leaderboard(self) -> str:
+        """Build the lifetime leaderboard message"""
+        leaderboard = await self._run_db(self.db.get_lifetime_leaderboard, LEADERBOARD_SIZE)
+        
+        if not leaderboard:
+            return "👑 <b>Lifetime Leaderboard</b>\n\n🤷‍♂️ No lifetime statistics available yet."
+        
+        leaderboard = [(html.escape(name), count) for name, count in leaderboard]
+        return "👑 <b>Lifetime Leaderboard</b> (All-time)\n\n" + format_leaderboard(leaderboard, "total questions")
+    
+    async def _invalidate_leaderboards(self):
+        """Drop cached leaderboards after stats change"""
+        if not self.redis:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(DAILY_LEADERBOARD_CACHE_KEY, LIFETIME_LEADERBOARD_CACHE_KEY)
+                pipe.incr(LEADERBOARD_GENERATION_KEY)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error invalidating leaderboard cache: {e}")
+    
+    async def sync_daily_ranking(self):
+        """Rebuild the Redis daily ranking from the database"""
+        async with self._ranking_lock:
+            await self._rebuild_daily_ranking()
+    
+    async def _rebuild_daily_ranking(self):
+        """Rebuild the Redis daily ranking (caller holds _ranking_lock)"""
+        if not self.redis:
+            return
+        try:
+            scores = await self._run_db(self.db.get_daily_scores)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(DAILY_RANKING_KEY)
+                pipe.zadd(DAILY_RANKING_KEY, {DAILY_RANKING_SYNCED: float('-inf'), **dict(scores)})
+                await pipe.execute()
+            logger.info(f"Daily ranking synced ({len(scores)} users)")
+        except Exception as e:
+            logger.error(f"Error syncing daily ranking: {e}")
+    
+    async def _update_daily_ranking(self, user: User, delta: int) -> Optional[Tuple[int, int, int]]:
+        """Apply a user's score change to the Redis ranking and drop cached leaderboards
+        in one round trip, returning (old_pos, new_pos, outranked_id) if the user moved up
+        into the displayed leaderboard (outranked_id is 0 when nobody was passed).
+        The caller holds _ranking_lock from the database write through this call."""
+        if not self.redis:
+            return None
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(DAILY_LEADERBOARD_CACHE_KEY, LIFETIME_LEADERBOARD_CACHE_KEY)
+                pipe.incr(LEADERBOARD_GENERATION_KEY)
+                
+                # Same exclusion rule as the database leaderboard queries; demo users are never ranked
+                if (user.username or user.first_name or '') == DEMO_USER_NAME:
+                    await pipe.execute()
+                    return None
+                
+                await self._update_ranking_script(
+                    keys=[DAILY_RANKING_KEY], args=[user.id, delta, DAILY_RANKING_SYNCED], client=pipe
+                )
+                _, _, positions = await pipe.execute()
+            
+            # The ranking was lost; rebuild it (this update is already in the database)
+            # and skip announcements rather than treat everyone as a newcomer
+            if positions is None:
+                await self._rebuild_daily_ranking()
+                return None
+            
+            old_pos, new_pos, outranked_id = positions
+            if 0 < new_pos < old_pos and new_pos <= LEADERBOARD_SIZE:
+                return (old_pos, new_pos, outranked_id)
+            return None
+        except Exception as e:
+            logger.error(f"Error updating daily ranking for {user.id}: {e}")
+            return None
+    
+    async def update_solved_questions_bulk(self, updates: List[Tuple[int, int]]) -> bool:
+        """Apply many (user_id, questions_count) updates, then rebuild the Redis ranking
+        and drop cached leaderboards (no overtake announcements are made)"""
+        async with self._ranking_lock:
+            success = await self._run_db(self.db.update_solved_questions_bulk, updates)
+            if success:
+                await self._rebuild_daily_ranking()
+        
+        if success:
+            await self._invalidate_leaderboards()
+            self._daily_ranks = None
+        return success
+    
+    async def sync_message_rights(self):
+        """Rebuild the Redis set of users holding unused message rights"""
+        async with self._rights_lock:
+            await self._rebuild_message_rights()
+    
+    async def _rebuild_message_rights(self):
+        """Rebuild the message rights set (caller holds _rights_lock)"""
+        if not self.redis:
+            return
+        try:
+            user_ids = await self._run_db(self.db.get_users_with_unused_message_rights)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(MESSAGE_RIGHTS_KEY)
+                pipe.sadd(MESSAGE_RIGHTS_KEY, MESSAGE_RIGHTS_SYNCED, *user_ids)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error syncing message rights: {e}")
+    
+    async def _may_have_message_right(self, user_id: int) -> bool:
+        """Cheap pre-check before looking up message rights in the database"""
+        if not self.redis:
+            return True
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.sismember(MESSAGE_RIGHTS_KEY, user_id)
+                pipe.sismember(MESSAGE_RIGHTS_KEY, MESSAGE_RIGHTS_SYNCED)
+                is_member, synced = await pipe.execute()
+            
+            # The set was lost (Redis restarted or evicted it); rebuild it once and
+            # let this message fall through to the database lookup
+            if not synced:
+                async with self._rights_lock:
+                    if not await self.redis.sismember(MESSAGE_RIGHTS_KEY, MESSAGE_RIGHTS_SYNCED):
+                        await self._rebuild_message_rights()
+                return True
+            
+            return bool(is_member)
+        except Exception as e:
+            logger.error(f"Error checking message rights for {user_id}: {e}")
+            return True
+    
+    async def _claim_auto_leaderboard(self, chat_id: int) -> bool:
+        """Allow at most one automatic leaderboard post per chat per interval"""
+        if self.redis:
+            try:
+                key = f"lb:auto:{chat_id}"
+                return bool(await self.redis.set(key, 1, nx=True, ex=AUTO_LEADERBOARD_INTERVAL))
+            except Exception as e:
+                logger.error(f"Error claiming auto leaderboard slot for {chat_id}: {e}")
+        
+        now = time.monotonic()
+        last_sent = self._auto_leaderboard_sent.get(chat_id)
+        if last_sent is not None and now - last_sent < AUTO_LEADERBOARD_INTERVAL:
+            return False
+        self._auto_leaderboard_sent[chat_id] = now
+        return True
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -29,74 +355,26 @@ class BotHandlers:
             return
         
         # Register user
-        success = self.db.register_user(
+        success = await self._run_db(
+            self.db.register_user,
             user.id, 
             user.username, 
             user.first_name, 
             user.last_name
         )
         
-        welcome_message = f"""
-🎯 **Welcome to Study Battle Bot!** 🎯
-
-Hello {get_user_display_name(user)}! 
-
-I'm here to help you track your daily study progress and compete with others!
-
-**Available Commands:**
-📚 `/solved <number>` - Log questions solved (supports negative numbers for corrections)
-🏆 `/lb` - View today's leaderboard
-👑 `/top` - View lifetime leaderboard
-📊 `/stats` - Check your personal statistics
-❓ `/help` - Show this help message
-
-**Features:**
-✅ Daily leaderboard that resets every 24 hours
-✅ Lifetime statistics that never reset
-✅ Support for negative corrections
-✅ Automatic leaderboard updates
-✅ 24/7 operation
-
-Start logging your solved questions with `/solved <number>`!
-Good luck with your studies! 📖
-        """
+        welcome_message = WELCOME_HTML_TMPL.format(name=html.escape(get_user_display_name(user)))
         
         # Store chat ID for group notifications
         self.chat_id = update.message.chat_id
-        await context.bot.send_message(chat_id=update.message.chat_id, text=welcome_message, parse_mode='Markdown')
+        await update.message.reply_html(welcome_message)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
         if not update.message:
             return
-        help_message = """
-🤖 **Study Battle Bot Help** 🤖
-
-**Commands:**
-📚 `/solved <number>` - Log solved questions
-   Examples: `/solved 5`, `/solved -2` (for corrections)
-
-🏆 `/lb` - Daily leaderboard (resets every 24 hours)
-👑 `/top` - Lifetime leaderboard (never resets)
-📊 `/stats` - Your personal statistics
-
-**Features:**
-• Daily tracking with automatic midnight reset
-• Lifetime statistics preservation
-• Negative number support for corrections
-• Automatic leaderboard updates after logging
-• Demo User exclusion from leaderboards
-
-**Tips:**
-• Use negative numbers to correct mistakes: `/solved -1`
-• Daily stats reset automatically at midnight UTC
-• Your lifetime stats are never reset
-• Bot operates 24/7 for continuous tracking
-
-Need more help? Contact the bot administrator!
-        """
         
-        await context.bot.send_message(chat_id=update.message.chat_id, text=help_message, parse_mode='Markdown')
+        await update.message.reply_html(HELP_HTML)
     
     async def register_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /register command (manual registration)"""
@@ -107,7 +385,8 @@ Need more help? Contact the bot administrator!
         if not user:
             return
         
-        success = self.db.register_user(
+        success = await self._run_db(
+            self.db.register_user,
             user.id, 
             user.username, 
             user.first_name, 
@@ -115,11 +394,11 @@ Need more help? Contact the bot administrator!
         )
         
         if success:
-            message = f"✅ Registration successful, {get_user_display_name(user)}!\nYou can now start logging your solved questions with `/solved <number>`"
+            message = f"✅ Registration successful, {html.escape(get_user_display_name(user))}!\nYou can now start logging your solved questions with <code>/solved &lt;number&gt;</code>"
         else:
             message = "❌ Registration failed. Please try again later."
         
-        await context.bot.send_message(chat_id=update.message.chat_id, text=message)
+        await update.message.reply_html(message)
     
     async def solved_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /solved command"""
@@ -131,14 +410,12 @@ Need more help? Contact the bot administrator!
             return
         
         # Ensure user is registered
-        self.db.register_user(user.id, user.username, user.first_name, user.last_name)
+        await self._run_db(self.db.register_user, user.id, user.username, user.first_name, user.last_name)
         
         if not context.args:
-            await context.bot.send_message(
-                chat_id=update.message.chat_id,
-                text="❌ Please specify the number of questions solved.\n"
-                     "Example: `/solved 5` or `/solved -2` (for corrections)",
-                parse_mode='Markdown'
+            await update.message.reply_html(
+                "❌ Please specify the number of questions solved.\n"
+                "Example: <code>/solved 5</code> or <code>/solved -2</code> (for corrections)"
             )
             return
         
@@ -147,20 +424,21 @@ Need more help? Contact the bot administrator!
             questions_count = parse_number(context.args[0])
             
             if questions_count is None:
-                await context.bot.send_message(
-                    chat_id=update.message.chat_id,
-                    text="❌ Invalid number format. Please use a valid integer.\n"
-                         "Examples: `5`, `-2`, `10`",
-                    parse_mode='Markdown'
+                await update.message.reply_html(
+                    "❌ Invalid number format. Please use a valid integer.\n"
+                    "Examples: <code>5</code>, <code>-2</code>, <code>10</code>"
                 )
                 return
             
-            # Update the database
-            success = self.db.update_solved_questions(user.id, questions_count)
+            # Update the database and the ranking together, so a rebuild never
+            # snapshots the write without the delta (or the delta twice)
+            async with self._ranking_lock:
+                success = await self._run_db(self.db.update_solved_questions, user.id, questions_count)
+                ranking_change = await self._update_daily_ranking(user, questions_count) if success else None
             
             if success:
                 # Get updated stats
-                stats = self.db.get_user_stats(user.id)
+                stats = await self._run_db(self.db.get_user_stats, user.id)
                 daily, lifetime = stats if stats else (0, 0)
                 
                 if questions_count > 0:
@@ -170,32 +448,36 @@ Need more help? Contact the bot administrator!
                 else:
                     message = f"✅ No change applied.\n\n"
                 
-                message += f"📊 **Your Statistics:**\n"
+                message += f"📊 <b>Your Statistics:</b>\n"
                 message += f"📅 Today: {daily} questions\n"
                 message += f"🏆 Lifetime: {lifetime} questions\n\n"
                 
                 # Store chat ID for notifications
                 self.chat_id = update.message.chat_id
                 
-                await context.bot.send_message(chat_id=update.message.chat_id, text=message, parse_mode='Markdown')
+                await update.message.reply_html(message)
                 
                 # Check for position changes and send notifications
-                await self.check_leaderboard_changes(update, context, user.id)
+                if self.redis:
+                    position_change = ranking_change
+                    if position_change and position_change[2]:
+                        await self.announce_ranking_change(context, user, *position_change)
+                else:
+                    position_change = await self.check_leaderboard_changes(update, context, user.id)
                 
-                # Auto-update leaderboard after logging questions
-                await self.daily_leaderboard_command(update, context, auto_triggered=True)
+                # Auto-update leaderboard only when the user actually moved up
+                if position_change and await self._claim_auto_leaderboard(update.message.chat_id):
+                    await self.daily_leaderboard_command(update, context, auto_triggered=True)
                 
             else:
-                await context.bot.send_message(
-                    chat_id=update.message.chat_id,
-                    text="❌ Failed to update your progress. Please make sure you're registered and try again."
+                await update.message.reply_text(
+                    "❌ Failed to update your progress. Please make sure you're registered and try again."
                 )
         
         except Exception as e:
             logger.error(f"Error in solved_command: {e}")
-            await context.bot.send_message(
-                chat_id=update.message.chat_id,
-                text="❌ An error occurred while processing your request. Please try again later."
+            await update.message.reply_text(
+                "❌ An error occurred while processing your request. Please try again later."
             )
     
     async def daily_leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, auto_triggered: bool = False):
@@ -204,16 +486,10 @@ Need more help? Contact the bot administrator!
             return
             
         try:
-            leaderboard = self.db.get_daily_leaderboard(10)
+            message = await self._get_rendered(DAILY_LEADERBOARD_CACHE_KEY, self._render_daily_leaderboard)
             
-            if not leaderboard:
-                message = "📅 **Daily Leaderboard**\n\n🤷‍♂️ No one has solved questions today yet."
-            else:
-                message = "📅 **Daily Leaderboard** (Resets every 24 hours)\n\n"
-                message += format_leaderboard(leaderboard, "questions today")
-            
-            prefix = "🔄 **Updated Leaderboard:**\n\n" if auto_triggered else ""
-            await update.message.reply_text(prefix + message, parse_mode='Markdown')
+            prefix = "🔄 <b>Updated Leaderboard:</b>\n\n" if auto_triggered else ""
+            await update.message.reply_html(prefix + message)
             
         except Exception as e:
             logger.error(f"Error in daily_leaderboard_command: {e}")
@@ -225,15 +501,9 @@ Need more help? Contact the bot administrator!
             return
             
         try:
-            leaderboard = self.db.get_lifetime_leaderboard(10)
-            
-            if not leaderboard:
-                message = "👑 **Lifetime Leaderboard**\n\n🤷‍♂️ No lifetime statistics available yet."
-            else:
-                message = "👑 **Lifetime Leaderboard** (All-time)\n\n"
-                message += format_leaderboard(leaderboard, "total questions")
+            message = await self._get_rendered(LIFETIME_LEADERBOARD_CACHE_KEY, self._render_lifetime_leaderboard)
             
-            await update.message.reply_text(message, parse_mode='Markdown')
+            await update.message.reply_html(message)
             
         except Exception as e:
             logger.error(f"Error in lifetime_leaderboard_command: {e}")
@@ -250,18 +520,16 @@ Need more help? Contact the bot administrator!
                 return
             
             # Ensure user is registered
-            self.db.register_user(user.id, user.username, user.first_name, user.last_name)
+            await self._run_db(self.db.register_user, user.id, user.username, user.first_name, user.last_name)
             
-            stats = self.db.get_user_stats(user.id)
+            stats = await self._run_db(self.db.get_user_stats, user.id)
             
             if stats:
                 daily, lifetime = stats
-                message = f"📊 **{get_user_display_name(user)}'s Statistics**\n\n"
-                message += f"📅 **Today:** {daily} questions solved\n"
-                message += f"🏆 **Lifetime:** {lifetime} total questions\n\n"
+                message = STATS_HTML_TMPL.format(name=html.escape(get_user_display_name(user)), daily=daily, lifetime=lifetime)
                 
                 if daily == 0 and lifetime == 0:
-                    message += "🎯 Start your study journey with `/solved <number>`!"
+                    message += "🎯 Start your study journey with <code>/solved &lt;number&gt;</code>!"
                 elif daily == 0:
                     message += "📚 No questions solved today. Time to get started!"
                 else:
@@ -270,7 +538,7 @@ Need more help? Contact the bot administrator!
             else:
                 message = "❌ Unable to retrieve your statistics. Please try again later."
             
-            await update.message.reply_text(message, parse_mode='Markdown')
+            await update.message.reply_html(message)
             
         except Exception as e:
             logger.error(f"Error in stats_command: {e}")
@@ -285,75 +553,101 @@ Need more help? Contact the bot administrator!
         if not user:
             return
         
-        # Simple admin check (you can modify this to use a proper admin list)
-        admin_ids = [int(x) for x in str(os.getenv('ADMIN_IDS', '')).split(',') if x.strip()]
-        
-        if user.id not in admin_ids and admin_ids:
+        # Simple admin check (an unset ADMIN_IDS allows everyone, a malformed one allows no one)
+        if ADMIN_IDS_INVALID or (ADMIN_IDS and user.id not in ADMIN_IDS):
             await update.message.reply_text("❌ You don't have permission to use this command.")
             return
         
         try:
-            success = self.db.reset_daily_stats()
+            async with self._ranking_lock:
+                success = await self._run_db(self.db.reset_daily_stats)
+                if success:
+                    await self._rebuild_daily_ranking()
             
             if success:
+                await self._invalidate_leaderboards()
+                self._daily_ranks = None
                 message = "✅ Daily statistics have been reset successfully!\n\n📅 All daily counts are now at 0.\n🏆 Lifetime statistics remain unchanged."
             else:
                 message = "❌ Failed to reset daily statistics. Please try again."
             
-            await context.bot.send_message(chat_id=update.message.chat_id, text=message)
+            await update.message.reply_text(message)
             
         except Exception as e:
             logger.error(f"Error in reset_daily_command: {e}")
-            await context.bot.send_message(chat_id=update.message.chat_id, text="❌ Error resetting daily statistics. Please try again later.")
+            await update.message.reply_text("❌ Error resetting daily statistics. Please try again later.")
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle non-command messages"""
+        """Handle non-command text messages (commands are filtered out by the handler)"""
         # Let users chat normally without bot interference
-        # Check if this is a special message from someone with messaging rights
-        if update.message and update.message.text and not update.message.text.startswith('/'):
-            await self.handle_special_message(update, context)
-        pass
+        if not update.message or not update.effective_user:
+            return
+        
+        # Only users with messaging rights can send a special message
+        if not await self._may_have_message_right(update.effective_user.id):
+            return
+        
+        await self.handle_special_message(update, context)
     
-    async def check_leaderboard_changes(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-        """Check for leaderboard position changes and notify"""
+    async def check_leaderboard_changes(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> Optional[Tuple[int, int]]:
+        """Check for leaderboard position changes and notify, returning (old_pos, new_pos) if the user moved up"""
+        position_change = None
         try:
-            # Get current leaderboard with IDs
-            new_leaderboard = self.db.get_daily_leaderboard_with_ids(10)
+            new_ranks = await self._run_db(self.db.get_daily_ranks)
+            old_ranks = self._daily_ranks
+            self._daily_ranks = new_ranks
             
-            # Check if user moved up in ranking
-            if self.last_leaderboard:
-                position_change = self.db.get_user_position_change(user_id, self.last_leaderboard, new_leaderboard)
+            # Check if user moved up into the displayed leaderboard
+            if old_ranks is not None:
+                position_change = self.db.get_user_position_change(user_id, old_ranks, new_ranks)
+                if position_change and position_change[1] > LEADERBOARD_SIZE:
+                    position_change = None
+            
+            if position_change:
+                old_pos, new_pos = position_change
                 
-                if position_change:
-                    old_pos, new_pos = position_change
-                    
-                    # Find who was outranked
-                    outranked_user = None
-                    for uid, name, score in self.last_leaderboard:
-                        if uid != user_id:
-                            # Check if this user was at the new position
-                            for i, (new_uid, new_name, new_score) in enumerate(new_leaderboard, 1):
-                                if uid == new_uid and i > new_pos:
-                                    outranked_user = (uid, name)
-                                    break
-                    
-                    # Send overtaking notification
-                    current_user_name = get_user_display_name(update.effective_user)
-                    
-                    if outranked_user and self.chat_id:
-                        outranked_id, outranked_name = outranked_user
-                        message = f"🏆 {current_user_name} lider tablosunda {outranked_name}'i geçti! {old_pos}. sıradan {new_pos}. sıraya yükseldi!"
-                        
-                        await context.bot.send_message(chat_id=self.chat_id, text=message)
-                        
-                        # Give special message right
-                        self.db.store_special_message_right(user_id, outranked_id, old_pos, new_pos)
-            
-            # Update last leaderboard
-            self.last_leaderboard = new_leaderboard
+                # The closest user now below who was ahead before
+                overtaken = [
+                    (pos, uid) for uid, pos in new_ranks.items()
+                    if pos > new_pos and old_ranks.get(uid, old_pos) < old_pos
+                ]
+                if overtaken:
+                    _, outranked_id = min(overtaken)
+                    outranked_name = await self._run_db(self.db.get_display_name, outranked_id) or "Unknown User"
+                    await self.notify_overtake(context, update.effective_user, outranked_id, outranked_name, old_pos, new_pos)
             
         except Exception as e:
             logger.error(f"Error checking leaderboard changes: {e}")
+        
+        return position_change
+    
+    async def announce_ranking_change(self, context: ContextTypes.DEFAULT_TYPE, user: User, old_pos: int, new_pos: int, outranked_id: int):
+        """Notify about an overtake detected in the Redis daily ranking"""
+        try:
+            outranked_name = await self._run_db(self.db.get_display_name, outranked_id) or "Unknown User"
+            await self.notify_overtake(context, user, outranked_id, outranked_name, old_pos, new_pos)
+            
+        except Exception as e:
+            logger.error(f"Error announcing ranking change: {e}")
+    
+    async def notify_overtake(self, context: ContextTypes.DEFAULT_TYPE, user: User, outranked_id: int, outranked_name: str, old_pos: int, new_pos: int):
+        """Send overtaking notification and grant a special message right"""
+        if not self.chat_id:
+            return
+        
+        current_user_name = get_user_display_name(user)
+        message = f"🏆 {current_user_name} lider tablosunda {outranked_name}'i geçti! {old_pos}. sıradan {new_pos}. sıraya yükseldi!"
+        
+        await self.outbox.put(self.chat_id, message)
+        
+        # Give special message right (under the lock so a concurrent rebuild can't drop it)
+        async with self._rights_lock:
+            stored = await self._run_db(self.db.store_special_message_right, user.id, outranked_id, old_pos, new_pos)
+            if stored and self.redis:
+                try:
+                    await self.redis.sadd(MESSAGE_RIGHTS_KEY, user.id)
+                except Exception as e:
+                    logger.error(f"Error caching message right for {user.id}: {e}")
     
     async def handle_special_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle special messages from users with messaging rights"""
@@ -362,40 +656,40 @@ Need more help? Contact the bot administrator!
                 return
                 
             user_id = update.effective_user.id
-            right_id = self.db.get_unused_message_right(user_id)
+            right_id = await self._run_db(self.db.get_unused_message_right, user_id)
             
             if right_id:
                 # User has a special message right
                 message = update.message.text
                 
                 # Get details about who they outranked
-                details = self.db.get_message_right_details(right_id)
+                details = await self._run_db(self.db.get_message_right_details, right_id)
+                
+                # No group to post to yet (e.g. right after a restart); keep the right for later
+                if details and not self.chat_id:
+                    return
+                
                 if details:
                     user_id, outranked_user_id, old_pos, new_pos = details
                     
                     # Get user names
                     current_user_name = get_user_display_name(update.effective_user)
                     
-                    # Find outranked user name from leaderboard
-                    outranked_name = "Unknown User"
-                    for uid, name, score in self.last_leaderboard:
-                        if uid == outranked_user_id:
-                            outranked_name = name
-                            break
+                    # Find outranked user name
+                    outranked_name = await self._run_db(self.db.get_display_name, outranked_user_id) or "Unknown User"
                     
                     # Send the special message
                     special_msg = f"@everyone, {current_user_name} lider tablosunda {outranked_name}'i geçti, mesajı: {message}"
                     
-                    await context.bot.send_message(chat_id=self.chat_id, text=special_msg)
+                    await self.outbox.put(self.chat_id, special_msg)
                     
                     # Mark the right as used
-                    self.db.use_message_right(right_id)
+                    await self._run_db(self.db.use_message_right, right_id)
+                    if self.redis and not await self._run_db(self.db.get_unused_message_right, user_id):
+                        await self.redis.srem(MESSAGE_RIGHTS_KEY, user_id)
                     
                     # Confirm to user
-                    await context.bot.send_message(
-                        chat_id=update.message.chat_id, 
-                        text="✅ Özel mesajın gönderildi!"
-                    )
+                    await update.message.reply_text("✅ Özel mesajın gönderildi!")
                     
         except Exception as e:
             logger.error(f"Error handling special message: {e}")
@@ -406,16 +700,16 @@ Need more help? Contact the bot administrator!
             if not self.chat_id:
                 return
                 
-            leaderboard = self.db.get_daily_leaderboard(1)
+            leaderboard = await self._run_db(self.db.get_daily_leaderboard, 1)
             
             if leaderboard:
                 champion_name, champion_score = leaderboard[0]
                 message = f"🏆 Ultimate ATPL Championship'in bugünki şampiyonu {champion_name}! 🏆"
                 
-                await context.bot.send_message(chat_id=self.chat_id, text=message)
+                await self.outbox.put(self.chat_id, message)
             else:
                 message = "🏆 Ultimate ATPL Championship'in bugün hiç katılımcısı olmadı."
-                await context.bot.send_message(chat_id=self.chat_id, text=message)
+                await self.outbox.put(self.chat_id, message)
                 
         except Exception as e:
             logger.error(f"Error sending daily champion message: {e}")
@@ -21,12 +21,14 @@ class Config:
     
     # Admin Configuration
     ADMIN_IDS: List[int] = []
+    ADMIN_IDS_INVALID = False  # Set when ADMIN_IDS is present but malformed; admin commands are then denied
     admin_ids_str = os.getenv('ADMIN_IDS', '')
     if admin_ids_str:
         try:
             ADMIN_IDS = [int(x.strip()) for x in admin_ids_str.split(',') if x.strip()]
         except ValueError:
             ADMIN_IDS = []
+            ADMIN_IDS_INVALID = True
     
     # Bot Settings
     MAX_QUESTIONS_PER_UPDATE = int(os.getenv('MAX_QUESTIONS_PER_UPDATE', '1000'))
@@ -72,6 +74,9 @@ class Config:
         if not cls.BOT_TOKEN:
             errors.append("BOT_TOKEN environment variable is required")
         
+        if cls.ADMIN_IDS_INVALID:
+            errors.append("ADMIN_IDS must be a comma-separated list of integer user IDs")
+        
         if cls.RESET_HOUR < 0 or cls.RESET_HOUR > 23:
             errors.append("RESET_HOUR must be between 0 and 23")
         
@@ -3,28 +3,241 @@ Database management for the Telegram Study Battle Bot
 Handles SQLite database operations for user data and leaderboards
 """
 
+import functools
 import sqlite3
 import logging
+import threading
+import time
+from contextlib import closing, contextmanager
 from datetime import datetime, timedelta
-from typing import List, Tuple, Optional, Union
+from typing import Dict, Iterator, List, Tuple, Optional, Union
 import os
+from db_pool import ConnectionPool
 
 logger = logging.getLogger(__name__)
 
+# Stored in PRAGMA user_version; bump whenever init_database gains new DDL
+SCHEMA_VERSION = 4
+
+# Seconds an in-process daily top-N result is reused before querying again
+DAILY_LEADERBOARD_CACHE_TTL = 2.0
+
+# Display name of the shared demo account, kept off every leaderboard
+DEMO_USER_NAME = 'Demo User'
+
+# Constant SQL text so the per-connection statement cache reuses compiled statements
+_SQL_USER_EXISTS = "SELECT user_id FROM users WHERE user_id = ?"
+
+# One statement covers both first registration and profile refreshes
+_SQL_UPSERT_USER = '''
+    INSERT INTO users (user_id, username, first_name, last_name, is_demo)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        is_demo = excluded.is_demo
+'''
+
+_SQL_INIT_DAILY = '''
+    INSERT OR IGNORE INTO daily_stats (user_id, questions_solved)
+    VALUES (?, 0)
+'''
+
+_SQL_INIT_LIFETIME = '''
+    INSERT OR IGNORE INTO lifetime_stats (user_id, total_questions)
+    VALUES (?, 0)
+'''
+
+# Apply a delta, clamping the running total at zero
+_SQL_ADD_DAILY = '''
+    INSERT INTO daily_stats (user_id, questions_solved, last_updated)
+    VALUES (?, MAX(0, ?), CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        questions_solved = MAX(0, questions_solved + ?),
+        last_updated = CURRENT_TIMESTAMP
+'''
+
+_SQL_ADD_LIFETIME = '''
+    INSERT INTO lifetime_stats (user_id, total_questions, last_updated)
+    VALUES (?, MAX(0, ?), CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        total_questions = MAX(0, total_questions + ?),
+        last_updated = CURRENT_TIMESTAMP
+'''
+
+# Batch variants of the above that skip user IDs missing from users
+_SQL_ADD_DAILY_IF_USER = '''
+    INSERT INTO daily_stats (user_id, questions_solved, last_updated)
+    SELECT ?, MAX(0, ?), CURRENT_TIMESTAMP
+    WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        questions_solved = MAX(0, questions_solved + ?),
+        last_updated = CURRENT_TIMESTAMP
+'''
+
+_SQL_ADD_LIFETIME_IF_USER = '''
+    INSERT INTO lifetime_stats (user_id, total_questions, last_updated)
+    SELECT ?, MAX(0, ?), CURRENT_TIMESTAMP
+    WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        total_questions = MAX(0, total_questions + ?),
+        last_updated = CURRENT_TIMESTAMP
+'''
+
+_SQL_DAILY_LB_WITH_IDS = '''
+    SELECT 
+        u.user_id,
+        COALESCE(u.username, u.first_name, 'Unknown User') as display_name,
+        d.questions_solved
+    FROM daily_stats d
+    JOIN users u ON d.user_id = u.user_id
+    WHERE d.questions_solved > 0 
+    AND u.is_demo = 0
+    ORDER BY d.questions_solved DESC
+    LIMIT ?
+'''
+
+_SQL_DAILY_SCORES = '''
+    SELECT d.user_id, d.questions_solved
+    FROM daily_stats d
+    JOIN users u ON d.user_id = u.user_id
+    WHERE d.questions_solved > 0 
+    AND u.is_demo = 0
+'''
+
+_SQL_DISPLAY_NAME = '''
+    SELECT COALESCE(username, first_name, 'Unknown User') as display_name
+    FROM users WHERE user_id = ?
+'''
+
+_SQL_DAILY_RANKS = '''
+    WITH ranked AS (
+        SELECT 
+            d.user_id,
+            RANK() OVER (ORDER BY d.questions_solved DESC) AS position
+        FROM daily_stats d
+        JOIN users u ON d.user_id = u.user_id
+        WHERE d.questions_solved > 0 
+        AND u.is_demo = 0
+    )
+    SELECT user_id, position FROM ranked
+'''
+
+_SQL_LIFETIME_LB = '''
+    SELECT 
+        COALESCE(u.username, u.first_name, 'Unknown User') as display_name,
+        l.total_questions
+    FROM lifetime_stats l
+    JOIN users u ON l.user_id = u.user_id
+    WHERE l.total_questions > 0 
+    AND u.is_demo = 0
+    ORDER BY l.total_questions DESC
+    LIMIT ?
+'''
+
+_SQL_USER_STATS = '''
+    SELECT 
+        COALESCE(d.questions_solved, 0) as daily,
+        COALESCE(l.total_questions, 0) as lifetime
+    FROM users u
+    LEFT JOIN daily_stats d ON u.user_id = d.user_id
+    LEFT JOIN lifetime_stats l ON u.user_id = l.user_id
+    WHERE u.user_id = ?
+'''
+
+_SQL_RESET_DAILY = "UPDATE daily_stats SET questions_solved = 0, last_updated = CURRENT_TIMESTAMP"
+
+_SQL_LOG_RESET = '''
+    INSERT INTO daily_reset_log (reset_date)
+    VALUES (DATE('now'))
+'''
+
+_SQL_COUNT_USERS = "SELECT COUNT(*) as total FROM users"
+
+_SQL_STORE_RIGHT = '''
+    INSERT INTO special_message_rights (user_id, outranked_user_id, old_position, new_position)
+    VALUES (?, ?, ?, ?)
+'''
+
+_SQL_UNUSED_RIGHT = '''
+    SELECT id FROM special_message_rights 
+    WHERE user_id = ? AND used = FALSE 
+    ORDER BY created_at DESC LIMIT 1
+'''
+
+_SQL_USERS_WITH_RIGHTS = '''
+    SELECT DISTINCT user_id FROM special_message_rights 
+    WHERE used = FALSE
+'''
+
+_SQL_USE_RIGHT = "UPDATE special_message_rights SET used = TRUE WHERE id = ?"
+
+_SQL_RIGHT_DETAILS = '''
+    SELECT user_id, outranked_user_id, old_position, new_position
+    FROM special_message_rights WHERE id = ?
+'''
+
+# Attempts made when SQLite still reports a lock after busy_timeout
+_DB_OP_ATTEMPTS = 3
+
+def _db_op(default=None):
+    """Run a DatabaseManager method, retrying lock errors with backoff and
+    logging any other failure; returns default (or default() if callable) on error"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            for attempt in range(_DB_OP_ATTEMPTS):
+                try:
+                    return fn(self, *args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if 'locked' in str(e) and attempt < _DB_OP_ATTEMPTS - 1:
+                        time.sleep(0.05 * 2 ** attempt)
+                        continue
+                    logger.error(f"Error in {fn.__name__}: {e}")
+                    break
+                except Exception as e:
+                    logger.error(f"Error in {fn.__name__}: {e}")
+                    break
+            return default() if callable(default) else default
+        return wrapper
+    return decorator
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "study_battle.db"):
+    def __init__(self, db_path: str = "study_battle.db", pool_size: int = 4):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size)
+        self._lb_cache: Optional[Tuple[float, int, List[Tuple[int, str, int]]]] = None  # (fetched at, limit, rows)
+        self._lb_generation = 0  # Bumped on every invalidation; results read under an older one are not cached
+        self._lb_lock = threading.Lock()
         
-    def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path)
+    @contextmanager
+    def get_connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled database connection for one transaction"""
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
     
     def init_database(self):
-        """Initialize database tables"""
+        """Initialize database tables (skipped when the schema is already current)"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
+                # WAL lets leaderboard reads run alongside writes; the mode is stored in the file
+                if self.db_path != ":memory:":
+                    cursor.execute("PRAGMA journal_mode=WAL")
+                
+                cursor.execute("PRAGMA user_version")
+                version = cursor.fetchone()['user_version']
+                if version >= SCHEMA_VERSION:
+                    logger.info("Database schema is up to date")
+                    return
+                
+                # sqlite3 autocommits DDL, so open the transaction explicitly: the schema
+                # changes, backfills and user_version then commit (or roll back) together
+                cursor.execute("BEGIN")
+                
                 # Create users table
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS users (
@@ -32,10 +245,18 @@ class DatabaseManager:
                         username TEXT,
                         first_name TEXT,
                         last_name TEXT,
-                        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_demo INTEGER DEFAULT 0
                     )
                 ''')
                 
+                # Databases created before is_demo existed get the column and a backfill
+                cursor.execute("PRAGMA table_info(users)")
+                if 'is_demo' not in {column['name'] for column in cursor}:
+                    cursor.execute("ALTER TABLE users ADD COLUMN is_demo INTEGER DEFAULT 0")
+                if version < 4:
+                    cursor.execute("UPDATE users SET is_demo = (COALESCE(username, first_name, '') = ?)", (DEMO_USER_NAME,))
+                
                 # Create daily_stats table (resets every 24 hours)
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS daily_stats (
@@ -65,6 +286,43 @@ class DatabaseManager:
                     )
                 ''')
                 
+                # Create special_message_rights table (granted on leaderboard overtakes)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS special_message_rights (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        outranked_user_id INTEGER,
+                        old_position INTEGER,
+                        new_position INTEGER,
+                        used BOOLEAN DEFAULT FALSE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (user_id),
+                        FOREIGN KEY (outranked_user_id) REFERENCES users (user_id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_smr_user_unused
+                    ON special_message_rights (user_id, created_at DESC) WHERE used = FALSE
+                ''')
+                
+                # Partial indexes matching the leaderboard queries, so top-N reads
+                # walk the index in order instead of scanning and sorting
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_daily_lb
+                    ON daily_stats (questions_solved DESC) WHERE questions_solved > 0
+                ''')
+                
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_lifetime_lb
+                    ON lifetime_stats (total_questions DESC) WHERE total_questions > 0
+                ''')
+                
+                # Give the query planner statistics for the new indexes
+                cursor.execute("ANALYZE")
+                
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                
                 conn.commit()
                 logger.info("Database initialized successfully")
                 
@@ -72,351 +330,246 @@ class DatabaseManager:
             logger.error(f"Error initializing database: {e}")
             raise
     
+    def _invalidate_daily_leaderboard(self):
+        """Drop the cached daily top-N after a score change"""
+        with self._lb_lock:
+            self._lb_generation += 1
+            self._lb_cache = None
+    
+    @_db_op(False)
     def register_user(self, user_id: int, username: Optional[str] = None, first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
         """Register a new user or update existing user info"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Check if user exists
-                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                if cursor.fetchone():
-                    # Update existing user
-                    cursor.execute('''
-                        UPDATE users 
-                        SET username = ?, first_name = ?, last_name = ?
-                        WHERE user_id = ?
-                    ''', (username, first_name, last_name, user_id))
-                else:
-                    # Insert new user
-                    cursor.execute('''
-                        INSERT INTO users (user_id, username, first_name, last_name)
-                        VALUES (?, ?, ?, ?)
-                    ''', (user_id, username, first_name, last_name))
-                    
-                    # Initialize stats for new user
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO daily_stats (user_id, questions_solved)
-                        VALUES (?, 0)
-                    ''', (user_id,))
-                    
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO lifetime_stats (user_id, total_questions)
-                        VALUES (?, 0)
-                    ''', (user_id,))
-                
-                conn.commit()
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error registering user {user_id}: {e}")
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Flag the demo account once here so leaderboard queries filter on a column
+            is_demo = int((username or first_name or '') == DEMO_USER_NAME)
+            
+            cursor.execute(_SQL_UPSERT_USER, (user_id, username, first_name, last_name, is_demo))
+            
+            # Initialize stats (no-op for users who already have rows)
+            cursor.execute(_SQL_INIT_DAILY, (user_id,))
+            
+            cursor.execute(_SQL_INIT_LIFETIME, (user_id,))
+            
+            conn.commit()
+            return True
     
+    @_db_op(False)
     def update_solved_questions(self, user_id: int, questions_count: int) -> bool:
         """Update solved questions count (can be negative for corrections)"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Ensure user is registered
-                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                if not cursor.fetchone():
-                    return False
-                
-                # Update daily stats
-                cursor.execute('''
-                    INSERT OR REPLACE INTO daily_stats (user_id, questions_solved, last_updated)
-                    VALUES (?, 
-                            COALESCE((SELECT questions_solved FROM daily_stats WHERE user_id = ?), 0) + ?,
-                            CURRENT_TIMESTAMP)
-                ''', (user_id, user_id, questions_count))
-                
-                # Update lifetime stats (only if positive or if it doesn't make total negative)
-                cursor.execute("SELECT total_questions FROM lifetime_stats WHERE user_id = ?", (user_id,))
-                current_lifetime = cursor.fetchone()
-                current_lifetime = current_lifetime[0] if current_lifetime else 0
-                
-                new_lifetime = max(0, current_lifetime + questions_count)
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO lifetime_stats (user_id, total_questions, last_updated)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, new_lifetime))
-                
-                # Ensure daily stats don't go negative
-                cursor.execute("SELECT questions_solved FROM daily_stats WHERE user_id = ?", (user_id,))
-                current_daily = cursor.fetchone()
-                if current_daily and current_daily[0] < 0:
-                    cursor.execute('''
-                        UPDATE daily_stats SET questions_solved = 0 WHERE user_id = ?
-                    ''', (user_id,))
-                
-                conn.commit()
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error updating solved questions for user {user_id}: {e}")
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Ensure user is registered
+            cursor.execute(_SQL_USER_EXISTS, (user_id,))
+            if not cursor.fetchone():
+                return False
+            
+            # Update daily and lifetime stats (neither goes below zero)
+            cursor.execute(_SQL_ADD_DAILY, (user_id, questions_count, questions_count))
+            cursor.execute(_SQL_ADD_LIFETIME, (user_id, questions_count, questions_count))
+            
+            conn.commit()
+            self._invalidate_daily_leaderboard()
+            return True
+    
+    @_db_op(False)
+    def update_solved_questions_bulk(self, updates: List[Tuple[int, int]]) -> bool:
+        """Apply many (user_id, questions_count) updates in one transaction (unregistered users are skipped)
+        
+        Only the in-process leaderboard cache is cleared here; the Redis ranking and rendered
+        leaderboards are left stale, so bot code should go through BotHandlers.update_solved_questions_bulk"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            params = [(user_id, count, user_id, count) for user_id, count in updates]
+            cursor.executemany(_SQL_ADD_DAILY_IF_USER, params)
+            cursor.executemany(_SQL_ADD_LIFETIME_IF_USER, params)
+            
+            conn.commit()
+            self._invalidate_daily_leaderboard()
+            return True
     
+    @_db_op(list)
     def get_daily_leaderboard_with_ids(self, limit: int = 10) -> List[Tuple[int, str, int]]:
-        """Get daily leaderboard with user IDs"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT 
-                        u.user_id,
-                        COALESCE(u.username, u.first_name, 'Unknown User') as display_name,
-                        d.questions_solved
-                    FROM daily_stats d
-                    JOIN users u ON d.user_id = u.user_id
-                    WHERE d.questions_solved > 0 
-                    AND COALESCE(u.username, u.first_name, '') != 'Demo User'
-                    ORDER BY d.questions_solved DESC
-                    LIMIT ?
-                ''', (limit,))
-                
-                return cursor.fetchall()
-                
-        except Exception as e:
-            logger.error(f"Error getting daily leaderboard with IDs: {e}")
-            return []
+        """Get daily leaderboard with user IDs (briefly cached in-process)"""
+        cache = self._lb_cache
+        if cache and time.monotonic() - cache[0] < DAILY_LEADERBOARD_CACHE_TTL and cache[1] >= limit:
+            return cache[2][:limit]
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            generation = self._lb_generation
+            fetched_at = time.monotonic()
+            cursor.execute(_SQL_DAILY_LB_WITH_IDS, (limit,))
+            
+            rows = [(row['user_id'], row['display_name'], row['questions_solved']) for row in cursor]
+            
+            # A write committed while we were reading; these rows may predate it
+            with self._lb_lock:
+                if generation == self._lb_generation:
+                    self._lb_cache = (fetched_at, limit, rows)
+            return rows[:]
+
+    @_db_op(list)
+    def get_daily_scores(self) -> List[Tuple[int, int]]:
+        """Get (user_id, questions_solved) for everyone ranked on today's leaderboard"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_DAILY_SCORES)
+            
+            return [(row['user_id'], row['questions_solved']) for row in cursor]
+
+    @_db_op()
+    def get_display_name(self, user_id: int) -> Optional[str]:
+        """Get a user's leaderboard display name"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_DISPLAY_NAME, (user_id,))
+            
+            result = cursor.fetchone()
+            return result['display_name'] if result else None
 
     def get_daily_leaderboard(self, limit: int = 10) -> List[Tuple[str, int]]:
         """Get daily leaderboard (excludes Demo User)"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT 
-                        COALESCE(u.username, u.first_name, 'Unknown User') as display_name,
-                        d.questions_solved
-                    FROM daily_stats d
-                    JOIN users u ON d.user_id = u.user_id
-                    WHERE d.questions_solved > 0 
-                    AND COALESCE(u.username, u.first_name, '') != 'Demo User'
-                    ORDER BY d.questions_solved DESC
-                    LIMIT ?
-                ''', (limit,))
-                
-                return cursor.fetchall()
-                
-        except Exception as e:
-            logger.error(f"Error getting daily leaderboard: {e}")
-            return []
+        return [(name, score) for _, name, score in self.get_daily_leaderboard_with_ids(limit)]
     
+    @_db_op(list)
     def get_lifetime_leaderboard(self, limit: int = 10) -> List[Tuple[str, int]]:
         """Get lifetime leaderboard (excludes Demo User)"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT 
-                        COALESCE(u.username, u.first_name, 'Unknown User') as display_name,
-                        l.total_questions
-                    FROM lifetime_stats l
-                    JOIN users u ON l.user_id = u.user_id
-                    WHERE l.total_questions > 0 
-                    AND COALESCE(u.username, u.first_name, '') != 'Demo User'
-                    ORDER BY l.total_questions DESC
-                    LIMIT ?
-                ''', (limit,))
-                
-                return cursor.fetchall()
-                
-        except Exception as e:
-            logger.error(f"Error getting lifetime leaderboard: {e}")
-            return []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_LIFETIME_LB, (limit,))
+            
+            return [(row['display_name'], row['total_questions']) for row in cursor]
     
+    @_db_op()
     def get_user_stats(self, user_id: int) -> Optional[Tuple[int, int]]:
         """Get user's daily and lifetime stats"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT 
-                        COALESCE(d.questions_solved, 0) as daily,
-                        COALESCE(l.total_questions, 0) as lifetime
-                    FROM users u
-                    LEFT JOIN daily_stats d ON u.user_id = d.user_id
-                    LEFT JOIN lifetime_stats l ON u.user_id = l.user_id
-                    WHERE u.user_id = ?
-                ''', (user_id,))
-                
-                result = cursor.fetchone()
-                return result if result else (0, 0)
-                
-        except Exception as e:
-            logger.error(f"Error getting user stats for {user_id}: {e}")
-            return None
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_USER_STATS, (user_id,))
+            
+            result = cursor.fetchone()
+            return (result['daily'], result['lifetime']) if result else (0, 0)
     
+    @_db_op(False)
     def reset_daily_stats(self) -> bool:
         """Reset all daily statistics"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Reset daily stats
-                cursor.execute("UPDATE daily_stats SET questions_solved = 0, last_updated = CURRENT_TIMESTAMP")
-                
-                # Log the reset
-                cursor.execute('''
-                    INSERT INTO daily_reset_log (reset_date)
-                    VALUES (DATE('now'))
-                ''')
-                
-                conn.commit()
-                logger.info("Daily stats reset successfully")
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error resetting daily stats: {e}")
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Reset daily stats
+            cursor.execute(_SQL_RESET_DAILY)
+            
+            # Log the reset
+            cursor.execute(_SQL_LOG_RESET)
+            
+            conn.commit()
+            self._invalidate_daily_leaderboard()
+            logger.info("Daily stats reset successfully")
+            return True
     
+    @_db_op(0)
     def get_total_users(self) -> int:
         """Get total number of registered users"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM users")
-                return cursor.fetchone()[0]
-        except Exception as e:
-            logger.error(f"Error getting total users: {e}")
-            return 0
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_COUNT_USERS)
+            return cursor.fetchone()['total']
     
+    @_db_op(False)
     def backup_database(self, backup_path: Optional[str] = None) -> bool:
         """Create a backup of the database"""
-        try:
-            if not backup_path:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_path = f"backup_study_battle_{timestamp}.db"
-            
-            # Simple file copy for SQLite
-            import shutil
-            shutil.copy2(self.db_path, backup_path)
-            logger.info(f"Database backup created: {backup_path}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error creating database backup: {e}")
-            return False
+        if not backup_path:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            backup_path = f"backup_study_battle_{timestamp}.db"
+        
+        # Online backup copies a consistent snapshot (including WAL pages) while writers keep going
+        with closing(sqlite3.connect(backup_path)) as dst, self.get_connection() as src:
+            src.backup(dst)
+        logger.info(f"Database backup created: {backup_path}")
+        return True
     
-    def get_user_position_change(self, user_id: int, old_leaderboard: List[Tuple[int, str, int]], new_leaderboard: List[Tuple[int, str, int]]) -> Optional[Tuple[int, int]]:
-        """Get user's position change (old_pos, new_pos) or None if no change"""
-        try:
-            old_pos = None
-            new_pos = None
-            
-            # Find positions in both leaderboards
-            for i, (uid, name, score) in enumerate(old_leaderboard, 1):
-                if uid == user_id:
-                    old_pos = i
-                    break
+    @_db_op(dict)
+    def get_daily_ranks(self) -> Dict[int, int]:
+        """Get today's leaderboard position for every ranked user as {user_id: position}"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
             
-            for i, (uid, name, score) in enumerate(new_leaderboard, 1):
-                if uid == user_id:
-                    new_pos = i
-                    break
-            
-            # Return change only if user improved position
-            if old_pos is not None and new_pos is not None and new_pos < old_pos:
-                return (old_pos, new_pos)
-            elif old_pos is None and new_pos is not None:
-                # New entry to leaderboard
-                return (len(old_leaderboard) + 1, new_pos)
-                
-            return None
+            cursor.execute(_SQL_DAILY_RANKS)
             
-        except Exception as e:
-            logger.error(f"Error getting user position change: {e}")
+            return {row['user_id']: row['position'] for row in cursor}
+    
+    def get_user_position_change(self, user_id: int, old_ranks: Dict[int, int], new_ranks: Dict[int, int]) -> Optional[Tuple[int, int]]:
+        """Get user's position change (old_pos, new_pos) or None if they did not move up"""
+        new_pos = new_ranks.get(user_id)
+        if new_pos is None:
             return None
+        
+        # A newcomer starts just below everyone already ranked
+        old_pos = old_ranks.get(user_id, len(old_ranks) + 1)
+        
+        return (old_pos, new_pos) if new_pos < old_pos else None
     
+    @_db_op(False)
     def store_special_message_right(self, user_id: int, outranked_user_id: int, old_pos: int, new_pos: int) -> bool:
         """Store special message right for user who outranked another"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Create special_message_rights table if not exists
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS special_message_rights (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        outranked_user_id INTEGER,
-                        old_position INTEGER,
-                        new_position INTEGER,
-                        used BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id),
-                        FOREIGN KEY (outranked_user_id) REFERENCES users (user_id)
-                    )
-                ''')
-                
-                cursor.execute('''
-                    INSERT INTO special_message_rights (user_id, outranked_user_id, old_position, new_position)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, outranked_user_id, old_pos, new_pos))
-                
-                conn.commit()
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error storing special message right: {e}")
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_STORE_RIGHT, (user_id, outranked_user_id, old_pos, new_pos))
+            
+            conn.commit()
+            return True
     
+    @_db_op()
     def get_unused_message_right(self, user_id: int) -> Optional[int]:
         """Get unused message right ID for user"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT id FROM special_message_rights 
-                    WHERE user_id = ? AND used = FALSE 
-                    ORDER BY created_at DESC LIMIT 1
-                ''', (user_id,))
-                
-                result = cursor.fetchone()
-                return result[0] if result else None
-                
-        except Exception as e:
-            logger.error(f"Error getting unused message right: {e}")
-            return None
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_UNUSED_RIGHT, (user_id,))
+            
+            result = cursor.fetchone()
+            return result['id'] if result else None
     
+    @_db_op(list)
+    def get_users_with_unused_message_rights(self) -> List[int]:
+        """Get IDs of users holding at least one unused message right"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_USERS_WITH_RIGHTS)
+            
+            return [row['user_id'] for row in cursor]
+    
+    @_db_op(False)
     def use_message_right(self, right_id: int) -> bool:
         """Mark message right as used"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    UPDATE special_message_rights SET used = TRUE WHERE id = ?
-                ''', (right_id,))
-                
-                conn.commit()
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error using message right: {e}")
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_USE_RIGHT, (right_id,))
+            
+            conn.commit()
+            return True
     
+    @_db_op()
     def get_message_right_details(self, right_id: int) -> Optional[Tuple[int, int, int, int]]:
         """Get message right details (user_id, outranked_user_id, old_pos, new_pos)"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT user_id, outranked_user_id, old_position, new_position
-                    FROM special_message_rights WHERE id = ?
-                ''', (right_id,))
-                
-                return cursor.fetchone()
-                
-        except Exception as e:
-            logger.error(f"Error getting message right details: {e}")
-            return None
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_RIGHT_DETAILS, (right_id,))
+            
+            result = cursor.fetchone()
+            if not result:
+                return None
+            return (result['user_id'], result['outranked_user_id'], result['old_position'], result['new_position'])
@@ -0,0 +1,79 @@
+"""
+SQLite connection pool for the Telegram Study Battle Bot
+Keeps a few long-lived connections open instead of reconnecting on every query
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+# Applied once per connection when it is opened
+# (journal_mode=WAL is persistent and is set once by DatabaseManager.init_database)
+CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-64000;
+    PRAGMA busy_timeout=5000;
+"""
+
+class ConnectionPool:
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        # Every connection to :memory: is a separate database, so share a single one
+        self.size = 1 if db_path == ":memory:" else size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection with the pool pragmas applied"""
+        # Connections are handed between worker threads, never shared at the same time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Rows are read by column name; DatabaseManager returns plain tuples to callers
+        conn.row_factory = sqlite3.Row
+        conn.executescript(CONNECTION_PRAGMAS)
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while below pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection and return it to the pool afterwards"""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
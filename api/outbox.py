@@ -0,0 +1,73 @@
+"""
+Outbound message queue for the Telegram Study Battle Bot
+Paces group notifications under Telegram's bot-wide sending limit
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class Outbox:
+    def __init__(self, send: Callable[..., Awaitable], rate: float = 25, burst: int = 5, dedupe_window: float = 2.0):
+        self.send = send  # coroutine taking sendMessage parameters as keyword arguments
+        self.rate = rate  # steady-state messages per second
+        self.burst = burst  # messages allowed back to back after an idle period
+        self.dedupe_window = dedupe_window  # seconds to drop repeats of the same text per chat
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._recent: Dict[Tuple[int, int], float] = {}  # (chat_id, hash(text)) -> queued at
+        self._task: Optional[asyncio.Task] = None
+
+    async def put(self, chat_id: int, text: str, **kwargs):
+        """Queue a message, dropping it if the same text was queued for the chat just before"""
+        now = time.monotonic()
+        self._recent = {key: ts for key, ts in self._recent.items() if now - ts < self.dedupe_window}
+
+        key = (chat_id, hash(text))
+        if key in self._recent:
+            return
+        self._recent[key] = now
+
+        await self.queue.put(dict(chat_id=chat_id, text=text, **kwargs))
+
+    def start(self):
+        """Start the background sender"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Flush pending messages (up to timeout) and stop the sender"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbox stopped with {self.queue.qsize()} unsent messages")
+        self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        """Send queued messages with token-bucket pacing"""
+        tokens = float(self.burst)
+        last = time.monotonic()
+
+        while True:
+            item = await self.queue.get()
+
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            last = now
+            if tokens < 1:
+                await asyncio.sleep((1 - tokens) / self.rate)
+                tokens = 1.0
+                last = time.monotonic()
+            tokens -= 1
+
+            try:
+                await self.send(**item)
+            except Exception as e:
+                logger.error(f"Error sending queued message to {item.get('chat_id')}: {e}")
+            finally:
+                self.queue.task_done()
@@ -3,55 +3,54 @@ Utility functions for the Telegram Study Battle Bot
 """
 
 import re
+from bisect import bisect_right
+from functools import lru_cache
 from typing import List, Tuple, Optional
 from telegram import User
 
+# Medal emojis for the top 3 places
+_MEDALS = ("🥇", "🥈", "🥉")
+
 def format_leaderboard(leaderboard: List[Tuple[str, int]], suffix: str = "questions") -> str:
     """Format leaderboard data into a readable string"""
     if not leaderboard:
         return "No data available."
     
-    formatted_lines = []
-    
-    for i, (name, count) in enumerate(leaderboard, 1):
-        # Medal emojis for top 3
-        if i == 1:
-            emoji = "🥇"
-        elif i == 2:
-            emoji = "🥈"
-        elif i == 3:
-            emoji = "🥉"
-        else:
-            emoji = f"{i}."
-        
-        # Format the line
-        formatted_lines.append(f"{emoji} {name}: {count} {suffix}")
-    
-    return "\n".join(formatted_lines)
+    return "\n".join(
+        f"{_MEDALS[i] if i < 3 else f'{i + 1}.'} {name}: {count} {suffix}"
+        for i, (name, count) in enumerate(leaderboard)
+    )
 
 def parse_number(input_str: str) -> Optional[int]:
     """Parse a string into an integer, supporting negative numbers"""
     try:
-        # Remove any whitespace
-        input_str = input_str.strip()
-        
-        # Check if it's a valid integer (including negative)
-        if re.match(r'^-?\d+$', input_str):
-            return int(input_str)
-        
-        return None
-    except (ValueError, AttributeError):
+        return int(input_str.strip())
+    except (ValueError, TypeError, AttributeError):
         return None
 
 def get_user_display_name(user: User) -> str:
     """Get display name for a user"""
-    if user.username:
-        return f"@{user.username}"
-    elif user.first_name:
-        return user.first_name
+    return cached_display_name(user.username, user.first_name)
+
+@lru_cache(maxsize=10000)
+def cached_display_name(username: Optional[str], first_name: Optional[str]) -> str:
+    """Build a display name from the name fields it depends on (memoized)"""
+    if username:
+        return f"@{username}"
+    elif first_name:
+        return first_name
     else:
         return "Unknown User"
 
+# Motivational messages for daily counts below 1, below 5, below 10 and from 10 up
+_PROGRESS_THRESHOLDS = (1, 5, 10)
+_PROGRESS_MESSAGES = (
+    "📚 No progress today yet. Let's get started!",
+    "🌱 Good start! Keep building momentum!",
+    "🔥 Great progress today!",
+    "🚀 Amazing work today! You're on fire!",
+)
+
 def format_user_stats(daily: int, lifetime: int, username: Optional[str] = None) -> str:
     """Format user statistics into a readable string"""
     header = f"📊 Statistics" + (f" for {username}" if username else "")
@@ -67,14 +66,8 @@ def format_user_stats(daily: int, lifetime: int, username: Optional[str] = None)
     # Add motivational message based on progress
     if daily == 0 and lifetime == 0:
         stats_lines.append("🎯 Ready to start your study journey?")
-    elif daily == 0:
-        stats_lines.append("📚 No progress today yet. Let's get started!")
-    elif daily < 5:
-        stats_lines.append("🌱 Good start! Keep building momentum!")
-    elif daily < 10:
-        stats_lines.append("🔥 Great progress today!")
     else:
-        stats_lines.append("🚀 Amazing work today! You're on fire!")
+        stats_lines.append(_PROGRESS_MESSAGES[bisect_right(_PROGRESS_THRESHOLDS, daily)])
     
     return "\n".join(stats_lines)
 
@@ -99,13 +92,15 @@ def format_time_until_reset(hours: int, minutes: int) -> str:
     else:
         return f"{hours} hour{'s' if hours != 1 else ''} and {minutes} minute{'s' if minutes != 1 else ''}"
 
+_USERNAME_UNSAFE_CHARS = re.compile(r'[^\w\s\-_@.]').sub
+
 def sanitize_username(username: str) -> str:
     """Sanitize username for display"""
     if not username:
         return "Unknown User"
     
     # Remove potentially problematic characters
-    sanitized = re.sub(r'[^\w\s\-_@.]', '', username)
+    sanitized = _USERNAME_UNSAFE_CHARS('', username)
     
     # Limit length
     if len(sanitized) > 50:
@@ -113,25 +108,12 @@ def sanitize_username(username: str) -> str:
     
     return sanitized or "Unknown User"
 
+# "Demo User" is covered by the demo pattern
+_DEMO_PATTERN = re.compile(r'demo|test|bot|admin_test', re.IGNORECASE).search
+
 def is_demo_user(username: Optional[str] = None, first_name: Optional[str] = None) -> bool:
     """Check if user is a demo user that should be excluded"""
-    demo_patterns = ['demo', 'test', 'bot', 'admin_test']
-    
-    if username:
-        username_lower = username.lower()
-        if any(pattern in username_lower for pattern in demo_patterns):
-            return True
-    
-    if first_name:
-        first_name_lower = first_name.lower()
-        if any(pattern in first_name_lower for pattern in demo_patterns):
-            return True
-        
-        # Specific check for "Demo User"
-        if first_name_lower == "demo user":
-            return True
-    
-    return False
+    return bool((username and _DEMO_PATTERN(username)) or (first_name and _DEMO_PATTERN(first_name)))
 
 def format_command_help(command: str, description: str, example: Optional[str] = None) -> str:
     """Format help text for a command"""
@@ -140,14 +122,15 @@ def format_command_help(command: str, description: str, example: Optional[str] =
         help_text += f"\nExample: {example}"
     return help_text
 
+# Backslash-escape table for special markdown characters
+_MARKDOWN_ESCAPES = str.maketrans({
+    char: f'\\{char}'
+    for char in ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+})
+
 def escape_markdown(text: str) -> str:
     """Escape special markdown characters"""
-    escape_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    
-    for char in escape_chars:
-        text = text.replace(char, f'\\{char}')
-    
-    return text
+    return text.translate(_MARKDOWN_ESCAPES)
 
 def format_error_message(error_type: str, details: Optional[str] = None) -> str:
     """Format error messages consistently"""